@@ -31,6 +31,7 @@
 
 import logging
 import datetime
+import concurrent.futures
 import wxlib.retrieve_nwp
 
 # CONFIGURATION
@@ -53,6 +54,9 @@ level_list = [1, 2, 3, 4, 7, 10]
 # Directory in which data will be stored.
 local_data_dir_path = '/mnt/data1/wxretrieval'
 
+# Maximum number of files downloaded in parallel.
+max_parallel_downloads = 4
+
 # RETRIEVAL
 # =============================================================================
 
@@ -66,8 +70,10 @@ logging.basicConfig(level=logging.INFO,
 wxlib.retrieve_nwp.set_local_base_directory(local_data_dir_path)
 
 # Prepare catalogue of remotely available data: check which data is available on the remote
-# server and which variables are stored in which files.
-catalogue = wxlib.retrieve_nwp.prepare_catalogue_of_available_dwd_data([model_name], [base_time], variable_list)
+# server and which variables are stored in which files. The catalogue is cached in the local data
+# directory; the remote server is only scanned again if the cached catalogue is older than 15 minutes.
+catalogue = wxlib.retrieve_nwp.load_or_refresh_catalogue([model_name], [base_time], variable_list,
+                                                         max_age_seconds=900)
 if catalogue is None:
     logging.warning('Catalogue is not valid.')
     exit()
@@ -89,7 +95,7 @@ if test_catalogue_storage:
 remote_datafiles = dict()
 for variable in variable_list:
     remote_files_for_variable = wxlib.retrieve_nwp.determine_remote_files_to_retrieve_dwd_fcvariable(
-        variable, model_name, base_time, grid_type, leadtime_list, level_list)
+        variable, model_name, base_time, grid_type, leadtime_list, level_list, catalogue_object=catalogue)
 
     if remote_files_for_variable is None:
         logging.critical(
@@ -103,5 +109,35 @@ for variable in variable_list:
         remote_datafiles[variable][grid_type] = remote_files_for_variable
 
 # Download forecast data, merge the individual GRIB file and convert to a NetCDF file.
-wxlib.retrieve_nwp.download_forecast_data(model_name, base_time, remote_datafiles)
-wxlib.retrieve_nwp.merge_and_convert_downloaded_files(model_name, base_time, remote_datafiles)
+# Downloading is bound by the network, merging and converting by the local CPU and disk. Hence, the
+# data is processed variable by variable: while the files of one variable are merged and converted
+# in the background, the files of the next variable are already being downloaded. The FTP connections
+# are opened once and shared by the downloads of all variables.
+connection_pool = wxlib.retrieve_nwp.open_dwd_opendata_ftpserver_connections(max_parallel_downloads)
+if connection_pool is None:
+    logging.critical("Unable to connect to the remote server.")
+    exit(1)
+retrieval_successful = True
+with concurrent.futures.ThreadPoolExecutor(max_workers=1) as conversion_executor:
+    conversion_futures = dict()
+    for variable, remote_datafiles_for_variable in remote_datafiles.items():
+        if not wxlib.retrieve_nwp.download_forecast_data(
+                model_name, base_time, {variable: remote_datafiles_for_variable}, max_parallel_downloads,
+                connection_pool=connection_pool):
+            logging.critical("Download of forecast data for variable '%s' failed." % variable)
+            retrieval_successful = False
+            break
+        conversion_futures[variable] = conversion_executor.submit(
+            wxlib.retrieve_nwp.merge_and_convert_downloaded_files,
+            model_name, base_time, {variable: remote_datafiles_for_variable})
+    wxlib.retrieve_nwp.close_dwd_opendata_ftpserver_connections(connection_pool)
+    for variable, conversion_future in conversion_futures.items():
+        try:
+            if not conversion_future.result():
+                logging.critical("Conversion of forecast data for variable '%s' failed." % variable)
+                retrieval_successful = False
+        except Exception as error_message:
+            logging.critical("Conversion of forecast data for variable '%s' failed: %s" % (variable, error_message))
+            retrieval_successful = False
+if not retrieval_successful:
+    exit(1)
@@ -30,19 +30,84 @@
 """
 
 import os
+import sys
+import posixpath
+import copy
+import time
+import hashlib
+import socket
+import re
 import ftplib
 import bz2
 import pickle
 import logging
+import queue
+import threading
+import collections
+import concurrent.futures
 import cdo
 import wxlib.config
 
 # Initialize a CDO instance (used to convert grib to NetCDF files).
 cdo_instance = cdo.Cdo()
 
+# Block size used for FTP transfers. Each block received from the server is handed to a Python callback
+# (while holding the GIL), hence blocks much larger than the ftplib default of 8 KiB keep the per-file
+# overhead of the download threads low.
+ftp_transfer_blocksize = 256 * 1024
+
+# Maximum number of files uncompressed at the same time by uncompress_files_into_file(). Each file is
+# uncompressed as a whole and its data is kept in memory until it has been written (the DWD files contain
+# a single GRIB field of at most a few MB); hence this bounds the memory used per merged file, at the cost
+# of using at most this many threads for uncompressing, independently of the number of CPU cores.
+uncompress_max_pending_files = 4
+
 # Initialize the global "catalogue" dictionary with the list of models specified in the config file.
 catalogue = dict.fromkeys(wxlib.config.dwd_nwp_models)
 
+# Index over the global catalogue, built by build_catalogue_index(). Maps
+# (model, base time string, variable, grid type) -> {leadtime: {level: file name}}.
+catalogue_index = dict()
+
+# Catalogues obtained by load_or_refresh_catalogue() during the lifetime of the process. Maps the
+# catalogue file name of a query -> (time of the remote scan, catalogue, catalogue index); the catalogue
+# and its index only hold the models of the query.
+catalogue_memory_cache = dict()
+
+# Maximum number of queries kept in 'catalogue_memory_cache'.
+catalogue_memory_cache_max_entries = 32
+
+# Listings of remote directories obtained by list_remote_directory(), so that catalogue scans with
+# overlapping queries do not list the same directories again. Maps remote directory -> (time of the
+# listing, list of names).
+remote_directory_listing_cache = dict()
+
+
+def build_variable_grid_types_lookup(models_grid_types):
+    """
+    Function to invert 'dwd_nwp_models_grid_types' from the config file.
+
+    Arg:
+    :param models_grid_types: Dictionary in the format of 'dwd_nwp_models_grid_types'.
+
+    Returns: Dictionary mapping model -> variable -> tuple of the grid types in which the variable is available.
+    """
+    lookup = dict()
+    for nwp_model, (model_grid_types_dict_list, _, _) in models_grid_types.items():
+        variable_grid_types = dict()
+        for grid_type_dict in model_grid_types_dict_list:
+            for grid_type, grid_type_variable_list in grid_type_dict.items():
+                for variable in grid_type_variable_list:
+                    variable_grid_types[sys.intern(variable)] = \
+                        variable_grid_types.get(variable, ()) + (sys.intern(grid_type),)
+        lookup[nwp_model] = variable_grid_types
+    return lookup
+
+
+# Lookup of the grid types available for each model and variable, so that the grid types of a variable
+# do not need to be searched for in the lists of 'dwd_nwp_models_grid_types'.
+dwd_nwp_models_variable_grid_types = build_variable_grid_types_lookup(wxlib.config.dwd_nwp_models_grid_types)
+
 
 def connect_to_dwd_opendata_ftpserver():
     """
@@ -54,14 +119,147 @@ def connect_to_dwd_opendata_ftpserver():
     repository = None
     logging.info("Connecting to remote ftp server '%s'..." % wxlib.config.dwd_base_url)
     try:
-        repository = ftplib.FTP(wxlib.config.dwd_base_url)
+        # Without a timeout, a connection dropped silently (e.g. by a firewall) blocks its thread forever
+        # instead of raising an error that triggers a reconnect.
+        repository = ftplib.FTP(wxlib.config.dwd_base_url, timeout=getattr(wxlib.config, "ftp_timeout", 60))
+        # Connections are kept in a pool and may be idle for a while (e.g. while data is converted);
+        # enable TCP keepalive so that they are not dropped by firewalls or NAT gateways in between. The
+        # first probe is sent after one minute instead of the system default (usually two hours, longer
+        # than the idle timeout of most NAT gateways).
+        repository.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            repository.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            repository.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            repository.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4)
+        # FTP commands are short request/response exchanges; send them without Nagle delay.
+        repository.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         repository.login()
         repository.cwd(wxlib.config.dwd_base_dir)
     except ftplib.all_errors as error_message:
         logging.error("Unable to connect to '%s': %s" % (wxlib.config.dwd_base_url, error_message))
+        if repository is not None:
+            repository.close()
+        repository = None
     return repository
 
 
+def reconnect_dwd_opendata_ftpserver(repository):
+    """
+    Function to replace a connection that has been dropped (e.g. closed by the server after a timeout)
+    by a new connection.
+
+    Arg:
+    :param repository: The broken repository object.
+
+    Returns: The new repository object. If no new connection can be established, the broken repository
+    object is returned unchanged, so that the number of connections in a pool stays the same; commands
+    issued on it fail with one of ftplib.all_errors, which triggers another reconnect.
+    """
+    logging.warning("Reconnecting to remote ftp server '%s'...", wxlib.config.dwd_base_url)
+    new_repository = connect_to_dwd_opendata_ftpserver()
+    if new_repository is None:
+        # NOTE: Do not close the broken repository object here; commands issued on a closed ftplib.FTP
+        # object raise AttributeError instead of one of ftplib.all_errors.
+        return repository
+    repository.close()
+    return new_repository
+
+
+def open_dwd_opendata_ftpserver_connections(number_of_connections):
+    """
+    Function to open a pool of FTP connections to the repository, so that
+    independent FTP commands can be issued in parallel.
+
+    Arg:
+    :param number_of_connections: Number of FTP connections to open.
+
+    Returns: A queue holding the connected repository objects; it may hold fewer connections than
+    requested (e.g. if the server limits the number of connections per client). The connections should be
+    closed with close_dwd_opendata_ftpserver_connections(). If no connection can be established returns None.
+    """
+    # Connecting and logging in takes several round trips to the server; establish all connections
+    # concurrently so that the setup latency is paid only once.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=number_of_connections) as executor:
+        repository_list = list(executor.map(lambda _: connect_to_dwd_opendata_ftpserver(),
+                                            range(number_of_connections)))
+
+    connection_pool = queue.Queue()
+    for repository in repository_list:
+        if repository is not None:
+            connection_pool.put(repository)
+    if connection_pool.empty():
+        return None
+    if connection_pool.qsize() < number_of_connections:
+        # Tasks using the pool wait for a free connection, hence fewer connections only reduce parallelism.
+        logging.warning("Only %i of %i connections to '%s' could be established.",
+                        connection_pool.qsize(), number_of_connections, wxlib.config.dwd_base_url)
+    return connection_pool
+
+
+def close_dwd_opendata_ftpserver_connections(connection_pool):
+    """
+    Function to terminate all FTP connections of a pool opened with open_dwd_opendata_ftpserver_connections().
+
+    Arg:
+    :param connection_pool: Queue holding the connected repository objects.
+    """
+    while not connection_pool.empty():
+        repository = connection_pool.get()
+        if repository.sock is None:
+            # Already closed.
+            continue
+        try:
+            repository.quit()
+        except ftplib.all_errors:
+            repository.close()
+
+
+def list_remote_directory(connection_pool, remote_dir):
+    """
+    Function to list the contents of a remote directory using a connection taken from the pool.
+
+    Arg:
+    :param connection_pool: Queue holding the connected repository objects.
+    :param remote_dir: Absolute path of the remote directory.
+
+    Returns: List of the names contained in the remote directory.
+    """
+    # Reuse a recent listing of the same directory; the DWD server updates its directories only when the
+    # data of a new base time arrives.
+    listing_max_age = getattr(wxlib.config, "ftp_listing_cache_max_age", 0)
+    if listing_max_age > 0:
+        # NOTE: Other threads may remove entries concurrently, hence look them up with get().
+        cached_listing = remote_directory_listing_cache.get(remote_dir)
+        if cached_listing is not None and time.time() - cached_listing[0] < listing_max_age:
+            return list(cached_listing[1])
+
+    repository = connection_pool.get()
+    try:
+        # Pass the directory to NLST instead of changing into it first, which saves one round trip.
+        # Depending on the server, the returned names may be prefixed with the directory.
+        try:
+            name_list = repository.nlst(remote_dir)
+        except ftplib.error_perm:
+            raise
+        except ftplib.all_errors:
+            # The connection may have been dropped; retry once with a new connection.
+            repository = reconnect_dwd_opendata_ftpserver(repository)
+            name_list = repository.nlst(remote_dir)
+        name_list = [posixpath.basename(name) for name in name_list]
+        if listing_max_age > 0:
+            # Drop expired listings, so that the cache only holds the directories listed recently.
+            listing_time = time.time()
+            for cached_remote_dir, cached_listing in list(remote_directory_listing_cache.items()):
+                if listing_time - cached_listing[0] >= listing_max_age:
+                    remote_directory_listing_cache.pop(cached_remote_dir, None)
+            remote_directory_listing_cache[remote_dir] = (listing_time, name_list)
+        return list(name_list)
+    finally:
+        connection_pool.put(repository)
+
+
 def set_local_base_directory(local_path):
     """
     Function to set the local base directory.
@@ -103,17 +301,25 @@ def write_dictionary_to_file(dictionary_object, dictionary_file_path):
         logging.error("Input dictionary object has no valid entries.")
         return False
 
-    if not os.path.isdir(dictionary_file_path):
-        logging.warning("Directory '%s' does not exist." % dictionary_file_path)
+    if not os.path.isdir(os.path.dirname(os.path.abspath(dictionary_file_path))):
+        logging.warning("Directory '%s' does not exist.", os.path.dirname(dictionary_file_path))
 
     if os.path.exists(dictionary_file_path):
         logging.warning("Overwriting existing dictionary file '%s'." % dictionary_file_path)
 
+    # Write to a temporary file in the same directory and move it into place afterwards, so that an
+    # interrupted write does not leave a truncated dictionary file behind.
+    # The name of the temporary file is unique per process and thread, as the same file may be written
+    # concurrently.
+    temporary_file_path = "%s.%i.%i.tmp" % (dictionary_file_path, os.getpid(), threading.get_ident())
     try:
-        with open(dictionary_file_path, 'wb') as handle:
-            pickle.dump(dictionary_object, handle)
+        with open(temporary_file_path, 'wb') as handle:
+            pickle.dump(dictionary_object, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file_path, dictionary_file_path)
     except (IOError, OSError, pickle.PickleError, pickle.UnpicklingError):
         logging.error("Unable to write dictionary file '%s'" % dictionary_file_path)
+        if os.path.exists(temporary_file_path):
+            os.unlink(temporary_file_path)
         return False
 
     return True
@@ -133,9 +339,9 @@ def read_dictionary_from_file(dictionary_file_path):
         return None
     try:
         with open(dictionary_file_path, 'rb') as handle:
-            dictionary_object = pickle.loads(handle.read())
+            dictionary_object = pickle.load(handle)
             return dictionary_object
-    except (IOError, OSError, pickle.PickleError, pickle.UnpicklingError):
+    except (IOError, OSError, EOFError, pickle.PickleError, pickle.UnpicklingError):
         logging.error("Unable to read dictionary file '%s'" % dictionary_file_path)
         return None
 
@@ -173,14 +379,78 @@ def read_catalogue_from_local_base_directory(catalogue_name):
 
     Returns: True if successful else False
     """
-    global catalogue
+    global catalogue, catalogue_index
     catalogue_file_path = os.path.join(get_local_base_directory(), catalogue_name)
     logging.info("Reading catalogue from file '%s'." % catalogue_file_path)
     catalogue = read_dictionary_from_file(catalogue_file_path)
-    return catalogue is not None
+    if catalogue is None:
+        return False
+    catalogue_index = build_catalogue_index(catalogue)
+    return True
+
+
+def parse_dwd_file_name(file_name, grid_type):
+    """
+    Function to extract base time, lead time and level from the name of a file on the DWD server, e.g.
+    'cosmo-d2_germany_rotated-lat-lon_model-level_2020021300_001_7_P.grib2.bz2'.
+
+    Arg:
+    :param file_name: Name of the file.
+    :param grid_type: Grid type of the file, e.g. 'rotated-lat-lon_model-level'.
+
+    Returns: Tuple (base time string, lead time, level). Lead time and level are integers, or None if the
+    file name does not contain them (e.g. level for files of single-level grid types).
+    """
+    fields = file_name.split(grid_type + "_", 1)[-1].split("_")
+    # The base time string is the same for all files of a base time; intern it so that the index
+    # shares a single string object.
+    basetime_str = sys.intern(fields[0])
+    leadtime = None
+    level = None
+    if len(fields) > 2 and fields[1].isdigit():
+        leadtime = int(fields[1])
+        if len(fields) > 3 and fields[2].isdigit():
+            level = int(fields[2])
+    return basetime_str, leadtime, level
+
+
+def dwd_file_name_sort_key(file_name, grid_type):
+    """
+    Function to obtain a key to sort the names of files on the DWD server by lead time and level.
+
+    Arg:
+    :param file_name: Name of the file.
+    :param grid_type: Grid type of the file, e.g. 'rotated-lat-lon_model-level'.
 
+    Returns: Tuple (lead time, level), with -1 for a missing lead time or level.
+    """
+    _, leadtime, level = parse_dwd_file_name(file_name, grid_type)
+    return (leadtime if leadtime is not None else -1, level if level is not None else -1)
+
+
+def build_catalogue_index(catalogue_object):
+    """
+    Function to build an index over a catalogue, so that the files for a given
+    variable, lead time and level can be looked up directly instead of scanning the file lists.
+
+    Arg:
+    :param catalogue_object : Dictionary object of the catalogue.
 
-def prepare_catalogue_of_available_dwd_data(queried_model_list, basetimes_list, variable_list):
+    Returns: The index, mapping (model, base time string, variable, grid type) -> {leadtime: {level: file name}}.
+    """
+    index = dict()
+    for nwp_model, basetime_dictionary in catalogue_object.items():
+        for base_hour_str, variable_dictionary in (basetime_dictionary or {}).items():
+            for variable, grid_type_file_list_dictionary in (variable_dictionary or {}).items():
+                for grid_type, file_list in (grid_type_file_list_dictionary or {}).items():
+                    for file_name in file_list or []:
+                        basetime_str, leadtime, level = parse_dwd_file_name(file_name, grid_type)
+                        leadtime_dictionary = index.setdefault((nwp_model, basetime_str, variable, grid_type), dict())
+                        leadtime_dictionary.setdefault(leadtime, dict())[level] = file_name
+    return index
+
+
+def prepare_catalogue_of_available_dwd_data(queried_model_list, basetimes_list, variable_list, connection_pool=None):
     """
     Function to prepare a catalogue (nested dictionaries), for the list of
     models queried. Updates the global variable 'catalogue' with the file
@@ -194,13 +464,13 @@ def prepare_catalogue_of_available_dwd_data(queried_model_list, basetimes_list,
     is updated for all base times available on the remote server.
     :param variable_list : List of variable names.e.g., ["p","t"],if None specified, then the catalogue is updated for
     all the available variables, for each base time in 'basetimes_list'
+    :param connection_pool : Pool of FTP connections as returned by open_dwd_opendata_ftpserver_connections(),
+    e.g. to share the connections with download_forecast_data(). If None, a pool is opened for the scan and
+    closed afterwards.
 
     Returns: catalogue object if successful else None
     """
-    global catalogue
-    repository = connect_to_dwd_opendata_ftpserver()
-    if repository is None:
-        return None
+    global catalogue, catalogue_index
     if basetimes_list is None:
         logging.error("Basetimes not specified. Catalogue preparation aborted.")
         return None
@@ -220,58 +490,117 @@ def prepare_catalogue_of_available_dwd_data(queried_model_list, basetimes_list,
     # available models, variables(grid types) and forecast base times of
     # the current day".
 
+    # NOTE: Model, base hour, variable and grid type names are repeated as keys all over the catalogue
+    # (and its index); they are interned so that all occurrences share one string object, which also
+    # keeps the pickled catalogue small.
+    queried_model_list = [sys.intern(nwp_model) for nwp_model in queried_model_list]
+    # Create list of strings representing the base times, to be used as subdirectory names
+    # on the DWD opendata server.
+    basetimes_strlist = [sys.intern(t.strftime("%H")) for t in basetimes_list]
+    basetimehour_dir_dict = {
+        (nwp_model, base_hour_str): os.path.join(wxlib.config.dwd_base_dir, nwp_model, "grib", base_hour_str)
+        for nwp_model in queried_model_list for base_hour_str in basetimes_strlist}
+
+    number_of_connections = getattr(wxlib.config, "ftp_max_connections", 4)
+    if variable_list is not None:
+        number_of_connections = max(1, min(number_of_connections, len(basetimehour_dir_dict) * len(variable_list)))
+    close_connection_pool = connection_pool is None
+    if close_connection_pool:
+        connection_pool = open_dwd_opendata_ftpserver_connections(number_of_connections)
+        if connection_pool is None:
+            return None
+
+    # Listing the remote directories is dominated by the round-trip time to the server. Hence, the
+    # directories of all models, base times and variables are listed in parallel, each thread using
+    # a connection taken from the pool.
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=number_of_connections) as executor:
+            if variable_list is None:
+                variable_list_futures = {
+                    key: executor.submit(list_remote_directory, connection_pool, basetimehour_dir)
+                    for key, basetimehour_dir in basetimehour_dir_dict.items()}
+                model_variable_lists = {
+                    key: [sys.intern(variable) for variable in future.result()]
+                    for key, future in variable_list_futures.items()}
+            else:
+                variable_list = [sys.intern(variable) for variable in variable_list]
+                model_variable_lists = dict.fromkeys(basetimehour_dir_dict, variable_list)
+
+            file_list_futures = {
+                (nwp_model, base_hour_str, variable): executor.submit(
+                    list_remote_directory, connection_pool, os.path.join(basetimehour_dir, variable))
+                for (nwp_model, base_hour_str), basetimehour_dir in basetimehour_dir_dict.items()
+                for variable in model_variable_lists[(nwp_model, base_hour_str)]}
+            remote_file_lists = {key: future.result() for key, future in file_list_futures.items()}
+    except ftplib.all_errors as error_message:
+        logging.error("Unable to list remote directories: %s", error_message)
+        return None
+    finally:
+        if close_connection_pool:
+            close_dwd_opendata_ftpserver_connections(connection_pool)
+
+    # The index of the new catalogue is filled while the files are classified, so that each file name
+    # is parsed only once (see build_catalogue_index()).
+    new_catalogue_index = dict()
+    file_count = 0
     for nwp_model in queried_model_list:
         model_dir = os.path.join(wxlib.config.dwd_base_dir, nwp_model, "grib")
-
-        logging.info("**** Checking for NWP model '%s' in remote directory '%s'..." % (nwp_model, model_dir))
-        repository.cwd(model_dir)
-
-        # Create list of strings representing the base times, to be used as subdirectory names
-        # on the DWD opendata server.
-        basetimes_strlist = [t.strftime("%H") for t in basetimes_list]
+        logging.info("**** Checking for NWP model '%s' in remote directory '%s'...", nwp_model, model_dir)
         catalogue[nwp_model] = dict.fromkeys(basetimes_strlist)
+        # Look up the model configuration once per model instead of for every variable and grid type.
+        model_grid_types_dict_list, number_of_model_levels, model_pressure_levels = \
+            wxlib.config.dwd_nwp_models_grid_types[nwp_model]
+        model_leadtimes = wxlib.config.dwd_nwp_models_leadtimes[nwp_model]
+        model_variable_grid_types = dwd_nwp_models_variable_grid_types[nwp_model]
 
         for basetime in basetimes_list:
-            base_time_str = basetime.strftime("%Y%m%d%H")
-            base_hour_str = basetime.strftime("%H")
-            logging.info("*** Checking for base time hour '%s'." % base_hour_str)
-            basetimehour_dir = os.path.join(model_dir, base_hour_str)
-            repository.cwd(basetimehour_dir)
-
-            if variable_list is None:
-                variable_list = repository.nlst()
-            catalogue[nwp_model][base_hour_str] = dict.fromkeys(variable_list)
-
-            for variable in variable_list:
-                logging.info("** Checking for forecast variable '%s'." % variable)
-                variable_dir = os.path.join(basetimehour_dir, variable)
-
-                repository.cwd(variable_dir)
-                file_list = repository.nlst()
-                model_grid_types_dict_list = (wxlib.config.dwd_nwp_models_grid_types[nwp_model])[0]
-                grid_type_list = [key for grid_type_dict in model_grid_types_dict_list for (key, value) in
-                                  grid_type_dict.items() if variable in value]
-                logging.info("Grid type list %s" % str(grid_type_list))
+            base_time_str = sys.intern(basetime.strftime("%Y%m%d%H"))
+            base_hour_str = sys.intern(basetime.strftime("%H"))
+            logging.info("*** Checking for base time hour '%s'.", base_hour_str)
+            model_variable_list = model_variable_lists[(nwp_model, base_hour_str)]
+            base_hour_number_of_leadtimes = model_leadtimes[base_hour_str]
+            catalogue[nwp_model][base_hour_str] = dict.fromkeys(model_variable_list)
+
+            for variable in model_variable_list:
+                file_list = remote_file_lists[(nwp_model, base_hour_str, variable)]
+                logging.info("** Checking for forecast variable '%s'.", variable)
+                grid_type_list = model_variable_grid_types.get(variable, ())
+                logging.info("Grid type list %s", grid_type_list)
                 if not grid_type_list:
                     logging.error("Variable %s doesn't exist in the grid types %s available in the model %s" % (
                     variable, model_grid_types_dict_list, nwp_model))
                     logging.error("Check in data_config.py")
                     return None
 
-                catalogue[nwp_model][base_hour_str][variable] = dict.fromkeys(grid_type_list)
-
-                for grid_type in grid_type_list:
-
-                    logging.info("Checking for grid type %s" % grid_type)
-                    catalogue[nwp_model][base_hour_str][variable][grid_type] = []
-                    number_of_leadtimes = wxlib.config.dwd_nwp_models_leadtimes[nwp_model][base_hour_str]
+                grid_type_file_list_dictionary = {grid_type: [] for grid_type in grid_type_list}
+                catalogue[nwp_model][base_hour_str][variable] = grid_type_file_list_dictionary
+                grid_type_leadtime_dictionaries = {grid_type: dict() for grid_type in grid_type_list}
+
+                # Classify the files by grid type in a single pass over the file list; the grid type contained
+                # in a file name is found with one search of a compiled pattern matching any of the grid types.
+                grid_type_pattern = re.compile("|".join([re.escape(grid_type) for grid_type in grid_type_list]))
+                for varaiable_file in file_list:
+                    logging.info("Checking for %s in %s", base_time_str, varaiable_file)
+                    grid_type_match = grid_type_pattern.search(varaiable_file)
+                    if grid_type_match is None:
+                        continue
+                    grid_type = grid_type_match.group(0)
+                    file_basetime_str, leadtime, level = parse_dwd_file_name(varaiable_file, grid_type)
+                    if file_basetime_str == base_time_str:
+                        grid_type_file_list_dictionary[grid_type].append(varaiable_file)
+                        grid_type_leadtime_dictionaries[grid_type].setdefault(leadtime, dict())[level] = varaiable_file
+
+                for grid_type, grid_type_file_list in grid_type_file_list_dictionary.items():
+
+                    logging.info("Checking for grid type %s", grid_type)
+                    number_of_leadtimes = base_hour_number_of_leadtimes
 
                     if "pressure-level" in grid_type:
                         logging.info("Pressure level")
-                        number_of_levels = len((wxlib.config.dwd_nwp_models_grid_types[nwp_model])[2])
+                        number_of_levels = len(model_pressure_levels)
                     elif "model-level" in grid_type:
                         logging.info("Model level")
-                        number_of_levels = (wxlib.config.dwd_nwp_models_grid_types[nwp_model])[1]
+                        number_of_levels = number_of_model_levels
                     elif "single-level" in grid_type:
                         logging.info("Single level")
                         number_of_levels = 1
@@ -286,28 +615,129 @@ def prepare_catalogue_of_available_dwd_data(queried_model_list, basetimes_list,
                     # number_of_leadtimes incremented by '1' because the file exist for leadtime '000' also
                     # A variable can exist in multiple grid types, hence divide by the length of grid_type_list
                     expected_file_count = ((number_of_leadtimes + 1) * number_of_levels)
-                    file_count = 0
-                    for varaiable_file in file_list:
-                        logging.info("Checking for %s %s in %s" % (grid_type, base_time_str, varaiable_file))
-                        if grid_type in varaiable_file and (base_time_str in varaiable_file):
-                            # logging.info("Checking for %s %s in %s" %(grid_type, base_time_str, varaiable_file))
-                            catalogue[nwp_model][base_hour_str][variable][grid_type].append(varaiable_file)
-                            file_count = file_count + 1
+                    file_count = len(grid_type_file_list)
+                    if grid_type_leadtime_dictionaries[grid_type]:
+                        new_catalogue_index[(nwp_model, base_time_str, variable, grid_type)] = \
+                            grid_type_leadtime_dictionaries[grid_type]
                     if file_count != expected_file_count:
                         logging.info("leadtimes %s levels %s" % (number_of_leadtimes, number_of_levels))
                         logging.error("Catalogue has total %s files, suitable files %s  but expected number is %s" % (
                         len(file_list), file_count, expected_file_count))
-                        repository.quit()
                         return None
-    repository.quit()
     logging.info("Catalogue of remote data files has been prepared.")
     if file_count == 0:
         return None
+    # The entries of the scanned models have been replaced in the catalogue; replace them in the index as
+    # well, but keep the entries of the models scanned by earlier calls.
+    scanned_model_set = set(queried_model_list)
+    catalogue_index = {key: leadtime_dictionary for key, leadtime_dictionary in catalogue_index.items()
+                       if key[0] not in scanned_model_set}
+    catalogue_index.update(new_catalogue_index)
     return catalogue
 
 
+def load_or_refresh_catalogue(queried_model_list, basetimes_list, variable_list, max_age_seconds=900):
+    """
+    Function to obtain the catalogue for the given query from a catalogue cached in memory by a previous
+    call in the same process, or else from a catalogue file cached in the 'local_base_directory'. Only if
+    no cached catalogue exists for this query, or if it is older than 'max_age_seconds', the remote server
+    is scanned with prepare_catalogue_of_available_dwd_data() and the result is stored in both caches.
+
+    Arg:
+    :param queried_model_list : List of model names, see prepare_catalogue_of_available_dwd_data().
+    :param basetimes_list : List of base times (datetime.datetime).
+    :param variable_list : List of variable names, see prepare_catalogue_of_available_dwd_data().
+    :param max_age_seconds : Maximum age of a cached catalogue file in seconds.
+
+    Returns: catalogue object if successful else None
+    """
+    global catalogue, catalogue_index
+    if basetimes_list is None:
+        logging.error("Basetimes not specified. Catalogue preparation aborted.")
+        return None
+
+    # The name of the cached catalogue file is derived from the query, so that different queries
+    # do not overwrite each other's catalogues.
+    query = "%s|%s|%s" % (
+        ",".join(queried_model_list) if queried_model_list is not None else "*",
+        ",".join([t.isoformat() for t in basetimes_list]),
+        ",".join(variable_list) if variable_list is not None else "*")
+    query_hash = hashlib.blake2b(query.encode("utf-8"), digest_size=8).hexdigest()
+    catalogue_name = "dwd_opendata_catalogue_%s.bin" % query_hash
+    catalogue_file_path = os.path.join(get_local_base_directory(), catalogue_name)
+
+    if queried_model_list is None:
+        queried_model_list = wxlib.config.dwd_nwp_models
+
+    # NOTE: prepare_catalogue_of_available_dwd_data() updates the global catalogue in place, hence the
+    # memory cache holds its own copies of the catalogues.
+    if catalogue_name in catalogue_memory_cache:
+        scan_time, cached_catalogue, cached_catalogue_index = catalogue_memory_cache[catalogue_name]
+        if time.time() - scan_time < max_age_seconds:
+            logging.info("Using catalogue cached in memory for query '%s'.", query)
+            # Replace the entries of the queried models, like a scan of the remote server would do.
+            if catalogue is None:
+                catalogue = dict()
+            catalogue.update(copy.deepcopy(cached_catalogue))
+            catalogue_index = {key: leadtime_dictionary for key, leadtime_dictionary in catalogue_index.items()
+                               if key[0] not in cached_catalogue}
+            catalogue_index.update(cached_catalogue_index)
+            return catalogue
+
+    if os.path.exists(catalogue_file_path) \
+            and time.time() - os.path.getmtime(catalogue_file_path) < max_age_seconds:
+        logging.info("Reading catalogue from file '%s'.", catalogue_file_path)
+        # NOTE: The global catalogue is only replaced if the file can be read; the rescan below updates it
+        # in place.
+        cached_catalogue = read_dictionary_from_file(catalogue_file_path)
+        if cached_catalogue is not None:
+            catalogue = cached_catalogue
+            catalogue_index = build_catalogue_index(catalogue)
+            store_catalogue_in_memory_cache(catalogue_name, os.path.getmtime(catalogue_file_path),
+                                            queried_model_list, max_age_seconds)
+            return catalogue
+        logging.warning("Cached catalogue '%s' cannot be used, rescanning remote server.", catalogue_file_path)
+
+    scan_time = time.time()
+    if prepare_catalogue_of_available_dwd_data(queried_model_list, basetimes_list, variable_list) is None:
+        return None
+    store_catalogue_in_memory_cache(catalogue_name, scan_time, queried_model_list, max_age_seconds)
+    store_catalogue_in_local_base_directory(catalogue, catalogue_name)
+    return catalogue
+
+
+def store_catalogue_in_memory_cache(catalogue_name, scan_time, queried_model_list, max_age_seconds):
+    """
+    Function to store a copy of the entries of the queried models in the global catalogue (and of the
+    corresponding entries of its index) in the memory cache used by load_or_refresh_catalogue().
+    Entries older than 'max_age_seconds' are removed from the cache, as well as the oldest entries
+    if the cache holds more than 'catalogue_memory_cache_max_entries' queries.
+
+    Arg:
+    :param catalogue_name : Name of the cached catalogue file of the query.
+    :param scan_time : Time of the remote scan the catalogue was obtained by.
+    :param queried_model_list : List of model names of the query.
+    :param max_age_seconds : Maximum age of cached catalogues in seconds.
+    """
+    current_time = time.time()
+    for cached_catalogue_name, cached_entry in list(catalogue_memory_cache.items()):
+        if current_time - cached_entry[0] >= max_age_seconds:
+            catalogue_memory_cache.pop(cached_catalogue_name, None)
+
+    queried_model_set = set(queried_model_list)
+    catalogue_memory_cache[catalogue_name] = (
+        scan_time,
+        copy.deepcopy({nwp_model: catalogue.get(nwp_model) for nwp_model in queried_model_set}),
+        {key: leadtime_dictionary for key, leadtime_dictionary in catalogue_index.items()
+         if key[0] in queried_model_set})
+
+    while len(catalogue_memory_cache) > catalogue_memory_cache_max_entries:
+        oldest_catalogue_name, _ = min(list(catalogue_memory_cache.items()), key=lambda item: item[1][0])
+        catalogue_memory_cache.pop(oldest_catalogue_name, None)
+
+
 def determine_remote_files_to_retrieve_dwd_fcvariable(
-        variable, model_name, basetime, grid_type, leadtime_list, level_list):
+        variable, model_name, basetime, grid_type, leadtime_list, level_list, catalogue_object=None):
     """
     Function to get the list of available files for a given variable from in a
     given model for a specified grid type and lead times as well as levels.
@@ -318,98 +748,187 @@ def determine_remote_files_to_retrieve_dwd_fcvariable(
     :param basetime: Datetime object specifying forecast base time
     :param grid_type: Grid type eg.,'rotated-lat-lon_model-level', a complete
     list of available grid types for each model is in 'config.py'
-    :param leadtime_list: Lead time in hours(xxx), e.g. [3, 6, 9, 12]
-    :param level_list: List of levels (pressure, e.g. [200, 300] or model level, e.g. [1, 2, 3, 4])
+    :param leadtime_list: Lead time in hours(xxx), e.g. [3, 6, 9, 12]. Any iterable of integer values
+    (e.g. a range or NumPy array) or of strings of integers (e.g. ["003", "006"]) is accepted.
+    :param level_list: List of levels (pressure, e.g. [200, 300] or model level, e.g. [1, 2, 3, 4]). Accepts
+    the same types as 'leadtime_list'.
+    :param catalogue_object: Catalogue (as returned by prepare_catalogue_of_available_dwd_data()) to search
+    in. If None, the global catalogue is used.
 
     Returns:
     If successful, the list of files passing the input criteria, else None
     """
+    if catalogue_object is None or catalogue_object is catalogue:
+        index = catalogue_index
+    else:
+        index = build_catalogue_index(catalogue_object)
+
+    # The catalogue index is keyed by plain integers; convert the queried values once.
+    if leadtime_list is not None:
+        leadtime_list = [int(leadtime) for leadtime in leadtime_list]
+    if level_list is not None:
+        level_list = [int(level) for level in level_list]
+
     queried_file_list = []
-    base_hour_str = basetime.strftime("%H")
     basetime_str = basetime.strftime("%Y%m%d%H")
-    complete_file_list = catalogue[model_name.lower()][base_hour_str][variable.lower()][grid_type]
-    if len(complete_file_list) == 0:
+    complete_file_index = index.get((model_name.lower(), basetime_str, variable.lower(), grid_type))
+    if not complete_file_index:
         logging.error("No data files found for variable '%s', grid type '%s', for NWP model '%s' at base time '%s'."
                       % (variable, grid_type, model_name, basetime_str))
         return None
 
-    # Check if the files are available for the input 'basetime_str'
-    for single_grb_file in complete_file_list:
-        if basetime_str not in single_grb_file:
-            logging.error("No data files found for base time '%s'." % basetime_str)
-            return None
+    # Look up the files for the queried 'leadtimes' and 'levels' in the catalogue index and keep track of
+    # the *_leadtime_levels_* (as they appear in the file names) for which no file is available.
+    failed_list = []
+    if leadtime_list is not None and level_list is not None:
+        for leadtime in leadtime_list:
+            level_file_dictionary = complete_file_index.get(leadtime, {})
+            for level in level_list:
+                if level in level_file_dictionary:
+                    queried_file_list.append(level_file_dictionary[level])
+                else:
+                    failed_list.append("_%03i_%i_" % (leadtime, level))
+    elif leadtime_list is not None:
+        for leadtime in leadtime_list:
+            if leadtime in complete_file_index:
+                queried_file_list.extend(complete_file_index[leadtime].values())
+            else:
+                failed_list.append("_%03i_" % leadtime)
+    elif level_list is not None:
+        for level in level_list:
+            level_file_list = [level_file_dictionary[level] for level_file_dictionary in complete_file_index.values()
+                               if level in level_file_dictionary]
+            if level_file_list:
+                queried_file_list.extend(level_file_list)
+            else:
+                failed_list.append("_%i_" % level)
+    else:  # If user doesn't specify any leadtime and level list, then all files of the given variable are selected
+        for level_file_dictionary in complete_file_index.values():
+            queried_file_list.extend(level_file_dictionary.values())
+
+    # If any of the 'leadtimes' or 'levels' queried by the user are not
+    # available, then return 'None' and exit.
+    if failed_list:
+        logging.error("Data not available for the following *_leadtime_levels_*: %s" % ",".join(failed_list))
+        return None
 
-    # NOTE: concatenate 'level' and 'leadtime' strings, as they appear adjacent
-    # to each other in file name e.g., 'cosmo-d2_germany_rotated-lat-lon_model-
-    # level_2020021300_001_7_P.grib2.bz2', this reduces the search complexity.
+    for single_grb_file in queried_file_list:
+        logging.info("Querying remote file '%s' for download..", single_grb_file)
 
-    leadtimelev_list = []
-    if leadtime_list is not None:
-        leadtime_list = ["_%03i_" % x for x in leadtime_list]
-        if level_list is not None:
-            level_list = ["%i_" % x for x in level_list]
-            for leadtime in leadtime_list:
-                for level in level_list:
-                    leadtimelev_list.append(leadtime + level)
-        else:
-            leadtimelev_list = leadtime_list
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("The following files have been queried for download:%s", "\n\t".join(queried_file_list))
+    return queried_file_list
+
+
+def retrieve_remote_file(repository, remote_file_path, local_file_path):
+    """
+    Function to transfer a single file. If a (partial) local copy of the file exists, only the missing
+    remainder is transferred, using the FTP REST command (or the complete file, if the server rejects
+    REST); complete local copies are skipped.
+
+    Args:
+    :param repository: The connected repository object.
+    :param remote_file_path: Absolute path of the file on the remote server.
+    :param local_file_path: Path of the local file the data is written to.
+
+    Raises ftplib.all_errors if the transfer fails.
+    """
+    local_file_size = 0
+    if os.path.exists(local_file_path):
+        local_file_size = os.path.getsize(local_file_path)
+    if local_file_size > 0:
+        # SIZE reports the number of bytes transferred in binary mode.
+        repository.voidcmd('TYPE I')
+        try:
+            remote_file_size = repository.size(remote_file_path)
+        except ftplib.error_perm:
+            remote_file_size = None
+        if remote_file_size == local_file_size:
+            logging.info("File '%s' has already been downloaded.", remote_file_path)
+            return
+        if remote_file_size is None or local_file_size > remote_file_size:
+            local_file_size = 0
+
+    if local_file_size > 0:
+        logging.info("Resuming download of file '%s' at byte %i..", remote_file_path, local_file_size)
+        try:
+            with open(local_file_path, 'ab', buffering=ftp_transfer_blocksize) as fptr:
+                repository.retrbinary('RETR ' + remote_file_path, fptr.write, blocksize=ftp_transfer_blocksize,
+                                      rest=local_file_size)
+            logging.info("    .. done")
+            return
+        except ftplib.error_perm as error_message:
+            # The server may not support resuming (REST); download the complete file instead. If the file
+            # is not available, the complete download fails with the same error.
+            logging.warning("Unable to resume download of file '%s' (%s), downloading the complete file..",
+                            remote_file_path, error_message)
     else:
-        if level_list is not None:
-            leadtimelev_list = ["_%i_" % x for x in level_list]
-        else:
-            leadtimelev_list = None
-
-    # Maintain a 'flag' array, to track if, all the queried 'leadtimes' and
-    # 'levels' are available.Initialize with 'False', i.e., none are available.
-
-    leadtimelev_list_flag = dict.fromkeys(leadtimelev_list, False)
-
-    for single_grb_file in complete_file_list:
-        if leadtimelev_list is not None:  # If user specified leadtime and/or level list exists,
-            # then filter files accordingly
-            if any(leadtimelevel in single_grb_file for leadtimelevel in leadtimelev_list):
-                logging.info("Querying remote file '%s' for download.." % single_grb_file)
-                queried_file_list.append(single_grb_file)
-
-                for leadtimelevel in leadtimelev_list:
-                    if leadtimelevel in single_grb_file:
-                        # Update the flag array as available \
-                        # for the leadtimelevel.
-                        leadtimelev_list_flag[leadtimelevel] = True
-                        break
-        else:  # If user doesn't specify any leadtime and level list, then all files of the given variable are selected
-            queried_file_list.append(single_grb_file)
-
-    logging.debug("Debug: 'leadtime_lev_list_flag' entries ('True' if any file found satisfying the user "
-                  "specification):\n%s" % str(leadtimelev_list_flag))
-
-    if leadtimelev_list is not None:  # If user specified leadtime and/or level list exists
-        # If any of the 'leadtimes' or 'levels' queried by the user are not
-        # available, then return 'None' and exit.
-        if False in leadtimelev_list_flag.values():
-            logging.debug(leadtimelev_list_flag)
-            failed_list = [leadtimelev for leadtimelev, flag in
-                           leadtimelev_list_flag.items() if flag is False]
-
-            logging.debug(failed_list)
-            logging.error("Data not available for the following *_leadtime_levels_*: %s" % ",".join(failed_list))
-            return None
+        logging.info("Downloading file '%s'..", remote_file_path)
+    with open(local_file_path, 'wb', buffering=ftp_transfer_blocksize) as fptr:
+        repository.retrbinary('RETR ' + remote_file_path, fptr.write, blocksize=ftp_transfer_blocksize)
+    logging.info("    .. done")
 
-    logging.debug("The following files have been queried for download:%s" % "\n\t".join(queried_file_list))
-    return queried_file_list
+
+def download_remote_file(connection_pool, remote_file_path, local_file_path):
+    """
+    Function to download a single file using a connection taken from the pool, see
+    retrieve_remote_file(). If the transfer is interrupted, e.g. because the server dropped the
+    connection, it is resumed once over a new connection. If the file is not available, prompt error
+    and delete the local empty file. If the transfer still fails, the partial file is kept so that a
+    later call can resume it.
+
+    Args:
+    :param connection_pool: Queue holding the connected repository objects.
+    :param remote_file_path: Absolute path of the file on the remote server.
+    :param local_file_path: Path of the local file the data is written to.
+
+    Returns: True if the file has been downloaded successfully, else False.
+    """
+    repository = connection_pool.get()
+    try:
+        try:
+            retrieve_remote_file(repository, remote_file_path, local_file_path)
+        except ftplib.error_perm:
+            raise
+        except ftplib.all_errors as error_message:
+            logging.warning("Download of file '%s' has been interrupted (%s), retrying..",
+                            remote_file_path, error_message)
+            repository = reconnect_dwd_opendata_ftpserver(repository)
+            retrieve_remote_file(repository, remote_file_path, local_file_path)
+    except ftplib.error_perm:
+        logging.error("File '%s' not available.", remote_file_path)
+        if os.path.exists(local_file_path):
+            os.unlink(local_file_path)
+        return False
+    except ftplib.all_errors as error_message:
+        logging.error("Download of file '%s' has been interrupted: %s", remote_file_path, error_message)
+        return False
+    finally:
+        connection_pool.put(repository)
+    return True
 
 
-def download_forecast_data(model_name, basetime, queried_dataset):
+def download_forecast_data(model_name, basetime, queried_dataset, max_parallel_downloads=None,
+                           connection_pool=None):
     """
     Function to download a given set of files, for a given model and for
-    forecast simulation started at a particular hour using ftp. If any error occurs during download
-    of a file, prompt error and delete the local empty file and quit ftp.
+    forecast simulation started at a particular hour using ftp. The files are downloaded
+    in parallel over several FTP connections. Files downloaded completely by an earlier call are
+    skipped, partially downloaded files are resumed. If the download of a file fails, prompt error and
+    abort the remaining downloads; the local file is deleted only if the remote file is not available,
+    partial files are kept so that a later call can resume them. Connections opened by this function
+    are terminated afterwards, a pool passed in by the caller is left open.
 
     Args:
     :param model_name: Name of the model.
     :param basetime: Datetime object specifying forecast base time
     :param queried_dataset: Dictionary of model diagnostic variable names and
                     corresponding list of files names to download.
+    :param max_parallel_downloads: Maximum number of files downloaded at the same time. If None,
+                    'ftp_max_connections' from the config file is used.
+    :param connection_pool: Pool of FTP connections as returned by open_dwd_opendata_ftpserver_connections(),
+                    e.g. to reuse the connections for the downloads of several variables. If None, a pool
+                    is opened for the downloads and closed afterwards.
 
     Returns: True if all files are downloaded successfully, else False.
     """
@@ -422,36 +941,162 @@ def download_forecast_data(model_name, basetime, queried_dataset):
     local_base_directory = get_local_base_directory()
     base_hour_str = basetime.strftime("%H")
     base_date_str = basetime.strftime("%Y%m%d")
-    os.chdir(local_base_directory)
     download_path = os.path.join(local_base_directory, model_name.upper(), base_date_str)
-    if os.path.isdir(download_path) is False:
-        os.makedirs(download_path)
-    os.chdir(download_path)
 
     model_dir = os.path.join(wxlib.config.dwd_base_dir, model_name.lower(), "grib")
     base_hour_dir = os.path.join(model_dir, base_hour_str)
-    repository = connect_to_dwd_opendata_ftpserver()
 
+    # Flatten the queried dataset into a list of (remote file path, local file path) tuples. The dataset is
+    # checked completely before any connection is opened or any file is written, so that an invalid
+    # dataset does not leave partial downloads behind.
+    download_list = []
     for variable, grid_type_file_list_dictionary in queried_dataset.items():
-        for grid_type, file_list in grid_type_file_list_dictionary.items():
-            variable_dir = os.path.join(base_hour_dir, variable)
-            repository.cwd(variable_dir)
-            logging.debug(",".join(file_list))
+        variable_dir = os.path.join(base_hour_dir, variable)
+        for grid_type, file_list in (grid_type_file_list_dictionary or {}).items():
+            if not file_list:
+                logging.error("Input dataset contains no files for variable '%s' (%s).", variable, grid_type)
+                return False
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(",".join(file_list))
             for single_grb_file in file_list:
+                download_list.append((os.path.join(variable_dir, single_grb_file),
+                                      os.path.join(download_path, single_grb_file)))
+    if not download_list:
+        logging.error("Input dataset contains no files.")
+        return False
+
+    # NOTE: Several downloads (e.g. of different variables) may create the directory concurrently.
+    os.makedirs(download_path, exist_ok=True)
+
+    if max_parallel_downloads is None:
+        max_parallel_downloads = getattr(wxlib.config, "ftp_max_connections", 4)
+    number_of_connections = max(1, min(max_parallel_downloads, len(download_list)))
+    close_connection_pool = connection_pool is None
+    if close_connection_pool:
+        connection_pool = open_dwd_opendata_ftpserver_connections(number_of_connections)
+        if connection_pool is None:
+            return False
+
+    download_successful = True
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=number_of_connections) as executor:
+            futures = [executor.submit(download_remote_file, connection_pool, remote_file_path, local_file_path)
+                       for remote_file_path, local_file_path in download_list]
+            for future in concurrent.futures.as_completed(futures):
+                if not future.result():
+                    # Abort the remaining downloads.
+                    for pending_future in futures:
+                        pending_future.cancel()
+                    download_successful = False
+                    break
+    finally:
+        # Also terminate the connections properly (QUIT) if the downloads are aborted by an exception.
+        if close_connection_pool:
+            close_dwd_opendata_ftpserver_connections(connection_pool)
+    if not download_successful:
+        return False
+    logging.info("    .. download of forecast data has finished.")
+    return True
+
+
+def uncompress_file(zip_file_name):
+    """
+    Function to uncompress a bz2 compressed file into memory. The complete compressed file is read and
+    the complete uncompressed data is returned, see 'uncompress_max_pending_files'.
+
+    Arg:
+    :param zip_file_name: Path of the compressed file.
+
+    Returns: The uncompressed data.
+    """
+    logging.info('Uncompressing file %s', zip_file_name)
+    with open(zip_file_name, 'rb') as zip_file_pointer:
+        return bz2.decompress(zip_file_pointer.read())
+
+
+def uncompress_files_into_file(zip_file_names, output_file_name):
+    """
+    Function to uncompress a list of bz2 compressed files and to concatenate the uncompressed data,
+    in the order of the list, in a single file. Decompression is CPU-bound, hence the files are
+    uncompressed in parallel (the bz2 module releases the GIL while decompressing); at most
+    'uncompress_max_pending_files' uncompressed files are kept in memory until they are written.
+
+    Arg:
+    :param zip_file_names: List of paths of the compressed files.
+    :param output_file_name: Path of the concatenated file. If an error occurs, the file is deleted.
+
+    Returns: True if successful, else False.
+    """
+    number_of_threads = min(os.cpu_count() or 1, uncompress_max_pending_files, len(zip_file_names))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=number_of_threads) as executor, \
+            open(output_file_name, 'wb') as output_file_pointer:
+        pending_futures = collections.deque()
+        for file_index, zip_file_name in enumerate(zip_file_names):
+            pending_futures.append((zip_file_name, executor.submit(uncompress_file, zip_file_name)))
+            # Write the uncompressed data of the oldest files while the following ones are uncompressed;
+            # after the last file has been submitted, write all remaining data.
+            is_last_file = file_index == len(zip_file_names) - 1
+            while pending_futures and (is_last_file or len(pending_futures) >= uncompress_max_pending_files):
+                pending_zip_file_name, future = pending_futures.popleft()
                 try:
-                    logging.info("Downloading file '%s'.." % single_grb_file)
-                    with open(single_grb_file, 'wb') as fptr:
-                        repository.retrbinary('RETR ' + single_grb_file, fptr.write)
-                        fptr.close()
-                        logging.info("    .. done")
-                except ftplib.error_perm:
-                    logging.error("File '%s' not available." % single_grb_file)
-                    os.unlink(single_grb_file)
-                    repository.quit()
+                    output_file_pointer.write(future.result())
+                except (OSError, EOFError, ValueError):
+                    # NOTE: bz2.decompress() raises ValueError (not EOFError) for truncated files, e.g. for
+                    # partial downloads.
+                    logging.error("Unable to uncompress file '%s'.", pending_zip_file_name)
+                    for _, pending_future in pending_futures:
+                        pending_future.cancel()
+                    output_file_pointer.close()
+                    os.unlink(output_file_name)
                     return False
+    return True
 
-    repository.quit()
-    logging.info("    .. download of forecast data has finished.")
+
+def merge_and_convert_variable_files(queried_dataset_path, variable, grid_type, file_list):
+    """
+    Function to merge the downloaded files of a single variable and grid type into one GRIB file and to
+    convert it to NetCDF, see merge_and_convert_downloaded_files().
+
+    Args:
+    :param queried_dataset_path: Local directory containing the downloaded files.
+    :param variable: Model diagnostic variable name.
+    :param grid_type: Grid type of the files.
+    :param file_list: List of the names of the downloaded files.
+
+    Returns: True if successful, else False
+    """
+    logging.info("* %s (%s) ..", variable, grid_type)
+    file_name = file_list[0].split('_')[0:5]
+    # cosmo-d2_germany_rotated-lat-lon_model-level_2020021300
+    file_name.append(variable.upper())
+    file_name = os.path.join(queried_dataset_path, '_'.join(file_name))
+    grib_file_name = file_name + '.grib2'
+    nc_file_name = file_name + '.nc'
+
+    if os.path.exists(grib_file_name):
+        os.remove(grib_file_name)
+        logging.info("Overwriting existing file %s for variable '%s'.", grib_file_name, variable)
+    if os.path.exists(nc_file_name):
+        os.remove(nc_file_name)
+        logging.info("Overwriting existing file %s for variable '%s'.", nc_file_name, variable)
+
+    # Create a single file for each variable and for given grid type: the files are uncompressed
+    # directly into the concatenated file, so that the uncompressed data is written to disk only once.
+    # The files are concatenated ordered by lead time and level (as numbers, not as strings), so that
+    # the records of each time step are contiguous in the concatenated file.
+    # 'cosmo-d2_germany_rotated-lat-lon_model-level_2020021300_001_7_P.grib2.bz2'
+    sorted_file_list = sorted(file_list, key=lambda variable_file: dwd_file_name_sort_key(variable_file, grid_type))
+    zip_file_names = [os.path.join(queried_dataset_path, variable_file) for variable_file in sorted_file_list]
+    if not uncompress_files_into_file(zip_file_names, grib_file_name):
+        return False
+    # Create the NetCDF file from the concatenated file.
+    cdo_instance.copy(input=grib_file_name, output=nc_file_name,
+                      options=getattr(wxlib.config, "cdo_netcdf_output_options", "-f nc"))
+    # Clean up the downloaded files as well as the concatenated file.
+    for variable_file in file_list:
+        os.unlink(os.path.join(queried_dataset_path, variable_file))
+    os.unlink(grib_file_name)
+    logging.info("    .. done")
     return True
 
 
@@ -477,67 +1122,26 @@ def merge_and_convert_downloaded_files(model_name, basetime, queried_dataset):
         return False
 
     local_base_directory = get_local_base_directory()
-    basetime_str = basetime.strftime("%Y%m%d%H")
     base_date_str = basetime.strftime("%Y%m%d")
 
-    os.chdir(local_base_directory)
     queried_dataset_path = os.path.join(local_base_directory, model_name.upper(), base_date_str)
 
     if not os.path.exists(queried_dataset_path):
         logging.error("The local dataset path '%s' doesn't exist." % queried_dataset_path)
         return False
 
-    os.chdir(queried_dataset_path)
-
-    for variable, grid_type_file_list_dictionary in queried_dataset.items():
-        for grid_type, file_list in grid_type_file_list_dictionary.items():
-            logging.info("* %s (%s) .." % (variable, grid_type))
-            for variable_file in file_list:
-                logging.info('Uncompressing file %s' % variable_file)
-                zip_file_name = variable_file
-                # 'cosmo-d2_germany_rotated-lat-lon_model-level_2020021300_001_7_P.grib2.bz2'
-                unzip_file_name = zip_file_name[:-4]
-
-                try:
-                    # Uncompress the files of each 'variable' and for given 'grid type', using bz2 module.
-                    with open(unzip_file_name, 'wb') as unzip_file_pointer, bz2.BZ2File(zip_file_name,
-                                                                                        'rb') as zip_file_pointer:
-                        for data in iter(lambda: zip_file_pointer.read(), b''):
-                            unzip_file_pointer.write(data)
-                        unzip_file_pointer.close()
-                        zip_file_pointer.close()
-                except (IOError, EOFError):
-                    logging.error("Unable to uncompress file '%s'." % variable)
-                    unzip_file_pointer.close()
-                    zip_file_pointer.close()
-                    os.unlink(unzip_file_name)
-                    return False
-
-            file_name = file_list[0].split('_')[0:5]
-            # cosmo-d2_germany_rotated-lat-lon_model-level_2020021300
-            file_name.append(variable.upper())
-            file_name = '_'.join(file_name)
-            grib_file_name = file_name + '.grib2'
-            nc_file_name = file_name + '.nc'
-
-            if os.path.exists(grib_file_name):
-                os.remove(grib_file_name)
-                logging.info("Overwriting existing file %s for variable '%s'." % (grib_file_name, variable))
-            if os.path.exists(nc_file_name):
-                os.remove(nc_file_name)
-                logging.info("Overwriting existing file %s for variable '%s'." % (nc_file_name, variable))
-
-            # Create a single file for each variable and for given grid type.
-            command = "cat " + "*" + grid_type + "*" + variable.upper() + \
-                      '.grib2 >' + grib_file_name
-            os.system(command)
-            # Create the NetCDF file from the concatenated file.
-            cdo_instance.copy(input=grib_file_name, output=nc_file_name, options='-f nc')
-            # Clean up the unzipped individual files.
-            command = "rm " + "*" + grid_type + '_' + basetime_str \
-                      + '*_' + variable.upper() + '.grib2*'
-            #          + '_*_*_' + variable.upper() + '.grib2*'
-            os.system(command)
-            logging.info("    .. done")
-
-    return True
+    # NOTE: All paths are absolute (no os.chdir()), so that this function can run concurrently with
+    # downloads of other variables, see retrieve_dwd_example.py.
+
+    # Each variable and grid type is merged and converted independently. Uncompressing is CPU-bound (and
+    # uses up to 'uncompress_max_pending_files' threads per job), converting runs in an external CDO process;
+    # hence, two of them are processed at the same time, so that the conversion of one overlaps the
+    # uncompressing of the other.
+    merge_jobs = [(variable, grid_type, file_list)
+                  for variable, grid_type_file_list_dictionary in queried_dataset.items()
+                  for grid_type, file_list in grid_type_file_list_dictionary.items()]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(2, len(merge_jobs)))) as executor:
+        merge_results = list(executor.map(
+            lambda merge_job: merge_and_convert_variable_files(queried_dataset_path, *merge_job), merge_jobs))
+
+    return all(merge_results)